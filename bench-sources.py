@@ -0,0 +1,72 @@
+"""Times csv_to_json.py and the source registry on a generated sources CSV.
+
+usage: python bench-sources.py [rows]
+
+The rows of sources.csv are repeated, with ?n=<i> appended to each feed url so
+they stay distinct, until there are `rows` of them (10200 by default). The CSV
+conversion is timed twice: with clean_cell, and with bleach.clean on every cell
+as csv_to_json.py used to do.
+"""
+import csv
+import json
+import os
+import runpy
+import sys
+import tempfile
+import time
+
+import bleach
+
+import config
+import source_registry
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate(path, rows):
+    with open(os.path.join(here, 'sources.csv')) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        sources = list(reader)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in range(rows):
+            row = list(sources[i % len(sources)])
+            row[1] = "%s?n=%s" % (row[1], i)
+            writer.writerow(row)
+
+
+def time_csv_to_json(workdir, clean_cell):
+    source_registry.clean_cell = clean_cell  # csv_to_json.py imports it when it runs
+    sys.argv = ['csv_to_json.py', os.path.join(workdir, 'feed.json')]
+    start = time.perf_counter()
+    runpy.run_path(os.path.join(here, 'csv_to_json.py'))
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10200
+    clean_cell = source_registry.clean_cell
+    with tempfile.TemporaryDirectory() as workdir:
+        generate(os.path.join(workdir, 'bench-sources.csv'), rows)
+        config.SOURCES_FILE = os.path.join(workdir, 'bench-sources')
+        config.NO_UPLOAD = '1'
+        os.chdir(workdir)  # csv_to_json.py writes sources.json here
+
+        print("csv_to_json.py, %s rows, bleach.clean on every cell: %.2f s" % (
+            rows, time_csv_to_json(workdir, lambda value: bleach.clean(value, strip=True))))
+        print("csv_to_json.py, %s rows, clean_cell: %.2f s" % (rows, time_csv_to_json(workdir, clean_cell)))
+
+        start = time.perf_counter()
+        with open('feed.json') as f:
+            feeds = source_registry.compile_registry(json.loads(f.read()))
+        print("Loading and compiling the registry: %.1f ms" % ((time.perf_counter() - start) * 1000))
+
+    calls = 100000
+    hostnames = ['edition.cnn.com', 'www.bbc.co.uk', 'ads.example.net', 'brave.com']
+    domains = [feed['destination_domains'] for feed in feeds.values()]
+    start = time.perf_counter()
+    for i in range(calls):
+        source_registry.domain_allowed(hostnames[i % len(hostnames)], domains[i % len(domains)])
+    print("domain_allowed: %.2f us per call" % ((time.perf_counter() - start) / calls * 1e6))
@@ -4,6 +4,9 @@ import os
 BRAVE_TODAY_CANONICAL_ID = os.getenv('BRAVE_TODAY_CANONICAL_ID', None)
 BRAVE_TODAY_CLOUDFRONT_CANONICAL_ID = os.getenv('BRAVE_TODAY_CLOUDFRONT_CANONICAL_ID', None)
 
+# In publish-first mode, how long (seconds) the image backfill may run before the feed is republished anyway.
+BACKFILL_DEADLINE = int(os.getenv('BACKFILL_DEADLINE', 600))
+
 # Set the number of processes to spawn for all multiprocessing tasks.
 CONCURRENCY = max(1, int(os.getenv('CONCURRENCY', os.cpu_count())))
 
@@ -13,11 +16,37 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING')
 # Disable uploads to S3. Useful when running locally or in CI.
 NO_UPLOAD = os.getenv('NO_UPLOAD', None)
 
+# Split the sources into this many partitions by publisher_id, each of which can run on its own node.
+PARTITION_COUNT = max(1, int(os.getenv('PARTITION_COUNT', 1)))
+# Partition for this node to process, or 'merge' to only merge the results of all partitions.
+# Unset runs all the partitions locally, in their own processes, and then merges them.
+PARTITION = os.getenv('PARTITION', None)
+# Directory shared by the nodes, where partitions write their results for the merge.
+PARTITION_DIR = os.getenv('PARTITION_DIR', 'feed/partitions')
+# The merge rejects partition results older than this (seconds), or written for another PARTITION_RUN_ID.
+PARTITION_MAX_AGE = int(os.getenv('PARTITION_MAX_AGE', 3600))
+# Same value on every node of a run. Generated when all the partitions run locally.
+PARTITION_RUN_ID = os.getenv('PARTITION_RUN_ID', None)
+
 PCDN_URL_BASE = os.getenv('PCDN_URL_BASE', 'https://pcdn.brave.software')
 # Canonical ID of the private S3 bucket
 PRIVATE_CDN_CANONICAL_ID = os.getenv('PRIVATE_CDN_CANONICAL_ID', None)
 PRIVATE_CDN_CLOUDFRONT_CANONICAL_ID = os.getenv('PRIVATE_CDN_CLOUDFRONT_CANONICAL_ID', None)
 PRIV_S3_BUCKET = os.getenv('PRIV_S3_BUCKET', 'brave-private-cdn-development')
 PUB_S3_BUCKET = os.getenv('PUB_S3_BUCKET', 'brave-today-cdn-development')
+# Publish the feed as soon as the text is processed, and again once the images are backfilled.
+PUBLISH_FIRST = os.getenv('PUBLISH_FIRST', None)
+# Report how many bytes each stage sends between processes, both ways: every task with its function and
+# arguments, partials included, and every result. Costs a second pickling of everything sent.
+REPORT_PICKLE_BYTES = os.getenv('REPORT_PICKLE_BYTES', None)
+
+# Bounds, in seconds, of the per-feed refresh intervals learned by the scheduler daemon.
+REFRESH_MIN_INTERVAL = int(os.getenv('REFRESH_MIN_INTERVAL', 300))
+REFRESH_MAX_INTERVAL = int(os.getenv('REFRESH_MAX_INTERVAL', 21600))
+
+# The scheduler daemon republishes once this many new articles came in, or at the latest after the deadline (seconds).
+REPUBLISH_MIN_CHANGES = int(os.getenv('REPUBLISH_MIN_CHANGES', 20))
+REPUBLISH_DEADLINE = int(os.getenv('REPUBLISH_DEADLINE', 900))
+
 SENTRY_URL = os.getenv('SENTRY_URL', '')
 SOURCES_FILE = os.getenv('SOURCES_FILE', 'sources')
@@ -1,12 +1,12 @@
 import csv
 import hashlib
 import json
+import logging
 import sys
 from urllib.parse import urlparse, urlunparse
 
-import bleach
-
 import config
+from source_registry import clean_cell, compile_domains, is_valid_domain
 from upload import upload_file
 
 in_path = "{}.csv".format(config.SOURCES_FILE)
@@ -17,7 +17,7 @@ by_url = {}
 sources_data = {}
 with open(in_path, 'r') as f:
     for row in csv.reader(f):
-        row = [bleach.clean(x, strip=True) for x in row]
+        row = [clean_cell(x) for x in row]
         if count < 1:
             count += 1
             continue
@@ -42,6 +42,11 @@ with open(in_path, 'r') as f:
         else:
             content_type = row[7]
 
+        destination_domains = compile_domains(row[9])
+        invalid_domains = {domain for domain in destination_domains if not is_valid_domain(domain)}
+        for domain in sorted(invalid_domains):
+            logging.warning("Dropping invalid destination domain %s of %s", domain, feed_url)
+
         record = {'category': row[3],
                   'default': default,
                   'publisher_name': row[2],
@@ -52,7 +57,7 @@ with open(in_path, 'r') as f:
                   'og_images': og_images,
                   'creative_instance_id': row[8],
                   'url': feed_url,
-                  'destination_domains': row[9]}
+                  'destination_domains': sorted(destination_domains - invalid_domains)}
         by_url[record['url']] = record
         sources_data[hashlib.sha256(feed_url.encode('utf-8')).hexdigest()] = {'enabled': default,
                                                                               'publisher_name': record[
@@ -5,11 +5,17 @@ import logging
 import math
 import multiprocessing
 import os
+import pathlib
+import resource
 import shutil
 import sys
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import partial
 from io import BytesIO
+from multiprocessing.reduction import ForkingPickler
 from queue import Queue
 from urllib.parse import urlparse, urlunparse, quote
 
@@ -17,10 +23,8 @@ import bleach
 import dateparser
 import feedparser
 import html2text
-import metadata_parser
 import pytz
 import requests
-import requests_cache
 import unshortenit
 from better_profanity import profanity
 from bs4 import BeautifulSoup as BS
@@ -29,17 +33,19 @@ from requests.exceptions import ConnectTimeout, HTTPError, InvalidURL, ReadTimeo
 
 import config
 import image_processor_sandboxed
+import opengraph
+import source_registry
 from upload import upload_file
 
 USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.49 Safari/537.36'
 TZ = timezone('UTC')
+MAX_ENTRY_AGE = timedelta(days=60)  # older articles are left out of the feed
 
 im_proc = image_processor_sandboxed.ImageProcessor(config.PRIV_S3_BUCKET)
 unshortener = unshortenit.UnshortenIt(default_timeout=5)
 
 logging.basicConfig(level=config.LOG_LEVEL)
 logging.getLogger("urllib3").setLevel(logging.ERROR)  # too many unactionable warnings
-logging.getLogger("metadata_parser").setLevel(logging.CRITICAL)  # hide NotParsableFetchError messages
 
 logging.info("Using %s processes for parallel tasks.", config.CONCURRENCY)
 
@@ -81,7 +87,53 @@ def process_image(item):
     return item
 
 
-def download_feed(feed):
+def get_entry_image(item):
+    if 'media_thumbnail' in item and 'url' in item['media_thumbnail'][0]:
+        return item['media_thumbnail'][0]['url']
+    elif 'media_content' in item and len(item['media_content']) > 0 and 'url' in item['media_content'][0]:
+        return item['media_content'][0]['url']
+    elif 'summary' in item and BS(item['summary'], features="html.parser").find_all('img'):
+        result = BS(item['summary'], features="html.parser").find_all('img')
+        if 'src' in result[0]:
+            return BS(item['summary'], features="html.parser").find_all('img')[0]['src']
+        else:
+            return ""
+    elif 'urlToImage' in item:
+        return item['urlToImage']
+    elif 'image' in item:
+        return item['image']
+    elif 'content' in item and item['content'] and item['content'][0]['type'] == 'text/html' and BS(
+            item['content'][0]['value'], features="html.parser").find_all('img'):
+        r = BS(item['content'][0]['value'], features="html.parser").find_all('img')[0]
+        if 'img' in r:
+            return BS(item['content'][0]['value'], features="html.parser").find_all('img')[0]['src']
+        else:
+            return ""
+    else:
+        return ""
+
+
+class FeedEntry():
+    "The fields of a feedparser entry that fixup_item reads, projected in the download worker"
+    __slots__ = ('updated', 'link', 'img', 'title', 'description', 'enclosures', 'category')
+
+    def __init__(self, entry):
+        if 'updated' in entry:
+            self.updated = entry['updated']
+        else:
+            self.updated = entry.get('published')
+        if 'link' in entry:
+            self.link = entry['link']
+        else:
+            self.link = entry.get('url')
+        self.img = get_entry_image(entry)
+        self.title = entry.get('title')
+        self.description = entry.get('description')
+        self.enclosures = entry.get('enclosures')
+        self.category = entry.get('category')
+
+
+def download_feed(feed, max_entries=None):
     report = {'size_after_get': None, 'size_after_insert': 0}
     max_feed_size = 10000000  # 10M
     try:
@@ -109,94 +161,75 @@ def download_feed(feed):
     except Exception as e:
         logging.error("Feed failed to parse [%s]: %s -- %s", e.__class__.__name__, feed, e)
         return None
-    # bypass serialization issues
-    feed_cache = dict(feed_cache)
-    if 'bozo_exception' in feed_cache:
-        del feed_cache['bozo_exception']
-    return {'report': report, 'feed_cache': feed_cache, 'key': feed}
+    # only send the parent what fixup_item reads
+    entries = [FeedEntry(entry) for entry in feed_cache['entries'][:max_entries]]
+    return {'report': report, 'feed_cache': {'entries': entries}, 'key': feed}
+
+
+class StalePartition(Exception):
+    pass
+
+
+def partition_feeds(feeds, partition, partition_count):
+    return {key: feeds[key] for key in feeds if int(feeds[key]['publisher_id'], 16) % partition_count == partition}
+
+
+def partition_path(category, partition, partition_count):
+    return os.path.join(config.PARTITION_DIR, "%s-%s-of-%s.json" % (category, partition, partition_count))
 
 
 def fixup_item(item, my_feed):
     out_item = {}
     if 'category' in my_feed:
         out_item['category'] = my_feed['category']
-    if 'updated' in item:
-        out_item['publish_time'] = dateparser.parse(item['updated'])
-    elif 'published' in item:
-        out_item['publish_time'] = dateparser.parse(item['published'])
-    else:
+    if item.updated is None:
         return None  # skip (no update field)
+    out_item['publish_time'] = dateparser.parse(item.updated)
     if out_item['publish_time'] == None:
         return None  # skip (no publish time)
     if out_item['publish_time'].tzinfo == None:
         TZ.localize(out_item['publish_time'])
     out_item['publish_time'] = out_item['publish_time'].astimezone(pytz.utc)
-    if not 'link' in item:
-        if 'url' in item:
-            item['link'] = item['url']
-        else:
-            return None  # skip (can't find link)
+    if item.link is None:
+        return None  # skip (can't find link)
 
     # check if the article belongs to allowed domains
-    if item.get('link'):
+    if item.link:
         if not my_feed.get('destination_domains'):
             return None
 
-        if (urlparse(item['link']).hostname or '') not in my_feed["destination_domains"]:
+        if not source_registry.domain_allowed(urlparse(item.link).hostname, my_feed['destination_domains']):
             return None
 
     # filter the offensive articles
-    if profanity.contains_profanity(item.get("title")):
+    if profanity.contains_profanity(item.title):
         return None
 
     try:
-        out_item['url'] = unshortener.unshorten(item['link'])
+        out_item['url'] = unshortener.unshorten(item.link)
     except (requests.exceptions.ConnectionError, ConnectTimeout, InvalidURL, ReadTimeout, SSLError, TooManyRedirects):
         return None  # skip (unshortener failed)
     except Exception as e:
-        logging.error("unshortener failed [%s]: %s -- %s", e.__class__.__name__, item['link'], e)
+        logging.error("unshortener failed [%s]: %s -- %s", e.__class__.__name__, item.link, e)
         return None  # skip (unshortener failed)
 
-    # image determination
-    if 'media_thumbnail' in item and 'url' in item['media_thumbnail'][0]:
-        out_item['img'] = item['media_thumbnail'][0]['url']
-    elif 'media_content' in item and len(item['media_content']) > 0 and 'url' in item['media_content'][0]:
-        out_item['img'] = item['media_content'][0]['url']
-    elif 'summary' in item and BS(item['summary'], features="html.parser").find_all('img'):
-        result = BS(item['summary'], features="html.parser").find_all('img')
-        if 'src' in result[0]:
-            out_item['img'] = BS(item['summary'], features="html.parser").find_all('img')[0]['src']
-        else:
-            out_item['img'] = ""
-    elif 'urlToImage' in item:
-        out_item['img'] = item['urlToImage']
-    elif 'image' in item:
-        out_item['img'] = item['image']
-    elif 'content' in item and item['content'] and item['content'][0]['type'] == 'text/html' and BS(
-            item['content'][0]['value'], features="html.parser").find_all('img'):
-        r = BS(item['content'][0]['value'], features="html.parser").find_all('img')[0]
-        if 'img' in r:
-            out_item['img'] = BS(item['content'][0]['value'], features="html.parser").find_all('img')[0]['src']
-        else:
-            out_item['img'] = ""
-    else:
-        out_item['img'] = ""
-    if not 'title' in item:
+    out_item['img'] = item.img
+    if item.title is None:
         # No title. Skip.
         return None
 
-    out_item['title'] = BS(item['title'], features="html.parser").get_text()
+    out_item['title'] = BS(item.title, features="html.parser").get_text()
 
     # add some fields
-    if 'description' in item and item['description']:
-        out_item['description'] = BS(item['description'], features="html.parser").get_text()
+    if item.description:
+        out_item['description'] = BS(item.description, features="html.parser").get_text()
     else:
         out_item['description'] = ""
     out_item['content_type'] = my_feed['content_type']
     if out_item['content_type'] == 'audio':
-        out_item['enclosures'] = item['enclosures']
+        out_item['enclosures'] = item.enclosures
     if out_item['content_type'] == 'product':
-        out_item['offers_category'] = item['category']
+        out_item['offers_category'] = item.category
     out_item['publisher_id'] = my_feed['publisher_id']
     out_item['publisher_name'] = my_feed['publisher_name']
     out_item['creative_instance_id'] = my_feed['creative_instance_id']
@@ -210,102 +243,248 @@ def fixup_item(item, my_feed):
     return out_item
 
 
+def probe_image_url(url):
+    "Returns url if the image header looks usable, without downloading the whole image"
+    if im_proc.is_cached(url):
+        return url  # probed and padded in an earlier run
+    try:
+        image_processor_sandboxed.probe_image(url, session=scrape_session)
+    except Exception:
+        return ""  # unreachable, unsupported format or too small
+    return url
+
+
+def get_image_url(img):
+    "The url to fetch the image of an item from, empty if it can't be parsed"
+    try:
+        parsed = urlparse(img)
+        if not parsed.scheme:
+            return urlunparse(parsed._replace(scheme='http'))
+        return img
+    except Exception as e:
+        logging.error("Can't parse image [%s]: %s -- %s", e.__class__.__name__, img, e)
+        return ""
+
+
+def get_cached_padded_img(img):
+    "Returns the padded_img url of the feed image img if an earlier run cached it, otherwise an empty string"
+    url = get_image_url(img)
+    if not url or not im_proc.is_cached(url):
+        return ""
+    cache_fn = "%s.jpg" % (hashlib.sha256(url.encode('utf-8')).hexdigest())
+    return "%s/brave-today/cache/%s.pad" % (config.PCDN_URL_BASE, cache_fn)
+
+
 def check_images_in_item(item, feeds):
     if item['img']:
-        try:
-            parsed = urlparse(item['img'])
-            if not parsed.scheme:
-                parsed = parsed._replace(scheme='http')
-                url = urlunparse(parsed)
-            else:
-                url = item['img']
-        except Exception as e:
-            logging.error("Can't parse image [%s]: %s -- %s", e.__class__.__name__, item['img'], e)
-            item['img'] = ""
-        try:
-            result = scrape_session.head(url, allow_redirects=True)
-            if not result.status_code == 200:
-                item['img'] = ""
-            else:
-                item['img'] = url
-        except SSLError:
-            item['img'] = ""
-        except:
-            item['img'] = ""
+        url = get_image_url(item['img'])
+        item['img'] = probe_image_url(url) if url else ""
     if item['img'] == "" or feeds[item['publisher_id']]['og_images'] == True:
         # if we came out of this without an image, lets try to get it from opengraph
+        feed_img = item['img']
         try:
-            page = metadata_parser.MetadataParser(url=item['url'], requests_session=scrape_session,
-                                                  support_malformed=True,
-                                                  search_head_only=True, strategy=['page', 'meta', 'og', 'dc'],
-                                                  requests_timeout=5)
-            item['img'] = page.get_metadata_link('image')
-        except metadata_parser.NotParsableFetchError as e:
-            if e.code and e.code not in (403, 429, 500, 502, 503):
-                logging.error("Error parsing [%s]: %s", e.code, item['url'])
-        except (UnicodeDecodeError, metadata_parser.NotParsable) as e:
+            item['img'] = opengraph.get_og_image(item['url'], session=scrape_session)
+        except HTTPError as e:
+            if e.response.status_code not in (403, 429, 500, 502, 503):
+                logging.error("Error parsing [%s]: %s", e.response.status_code, item['url'])
+        except requests.exceptions.RequestException:
+            pass  # skip (unreachable page)
+        except Exception as e:
             logging.error("Error parsing: %s -- %s", item['url'], e)
         if item['img'] == None:
             item['img'] = ""
+        elif item['img'] and item['img'] != feed_img:
+            item['img'] = probe_image_url(item['img'])
     return item
 
 
-expire_after = timedelta(hours=2)
-scrape_session = requests_cache.core.CachedSession(expire_after=expire_after, backend='memory', timeout=5)
-scrape_session.cache.remove_old_entries(datetime.utcnow() - expire_after)
+def check_and_process_image(item, feeds):
+    "Both image stages in one trip to the worker"
+    return process_image(check_images_in_item(item, feeds))
+
+
+class ImageBackfill():
+    "Image work deferred by publish-first mode, kept in feed/<category>-backfill.json between runs"
+
+    MAX_ATTEMPTS = 3  # after that an item's image counts as unusable, recorded as padded_img ''
+
+    def __init__(self, category):
+        self.path = "feed/%s-backfill.json" % (category)
+        self.queue = {}  # url_hash -> item waiting for check_and_process_image
+        self.images = {}  # url_hash -> padded_img of items done, '' if they failed MAX_ATTEMPTS times
+        self.attempts = {}  # url_hash -> failed attempts so far
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                state = json.loads(f.read())
+            self.queue = state['queue']
+            self.images = state['images']
+            self.attempts = state.get('attempts', {})
+
+    def save(self):
+        with open("%s-tmp" % (self.path), 'w') as f:
+            f.write(json.dumps({'queue': self.queue, 'images': self.images, 'attempts': self.attempts}))
+        os.replace("%s-tmp" % (self.path), self.path)
+
+    def defer(self, items, processor):
+        """Sets padded_img of the items done in earlier runs and queues the others, forgets items no longer in the feed.
+
+        Items whose feed image is in the image cache already count as done. The cache is
+        looked up in processor's workers, the s3 lookups would hold up the publish otherwise.
+        """
+        url_hashes = {item['url_hash'] for item in items}
+        self.queue = {url_hash: self.queue[url_hash] for url_hash in self.queue if url_hash in url_hashes}
+        self.images = {url_hash: self.images[url_hash] for url_hash in self.images if url_hash in url_hashes}
+        self.attempts = {url_hash: self.attempts[url_hash] for url_hash in self.attempts if url_hash in url_hashes}
+        lookups = [item for item in items if item['url_hash'] not in self.images and item['img']]
+        if lookups:
+            logging.info("Looking up cached images for %s items...", len(lookups))
+            with processor.worker_pool() as pool:
+                for item, padded_img in zip(lookups, pool.imap(get_cached_padded_img,
+                                                               [item['img'] for item in lookups])):
+                    if padded_img:
+                        self.images[item['url_hash']] = padded_img
+                        self.queue.pop(item['url_hash'], None)
+                        self.attempts.pop(item['url_hash'], None)
+        for item in items:
+            if item['url_hash'] in self.images:
+                item['padded_img'] = self.images[item['url_hash']]
+            else:
+                self.queue.setdefault(item['url_hash'], dict(item))
+                item['padded_img'] = ''  # requested stop gap to fix client parser
+            del item['img']
+
+    def drain(self, processor, deadline):
+        "Processes queued images until the queue is empty or deadline (unix time) passes"
+        items = [item for item in self.queue.values() if item['publisher_id'] in processor.feeds]
+        if not items:
+            return
+        logging.info("Backfilling images for %s items...", len(items))
+        with processor.worker_pool() as pool:
+            results = pool.imap_unordered(partial(check_and_process_image, feeds=processor.image_feeds(items)), items)
+            for _ in items:
+                try:
+                    # don't let stuck workers hold the republish past the deadline
+                    item = results.next(timeout=max(0, deadline - time.time()))
+                except multiprocessing.TimeoutError:
+                    logging.warning("Image backfill deadline passed with %s items left.", len(self.queue))
+                    break
+                url_hash = item['url_hash']
+                del self.queue[url_hash]
+                if item['padded_img']:
+                    self.images[url_hash] = item['padded_img']
+                    self.attempts.pop(url_hash, None)
+                else:
+                    self.attempts[url_hash] = self.attempts.get(url_hash, 0) + 1
+                    if self.attempts[url_hash] >= self.MAX_ATTEMPTS:
+                        self.images[url_hash] = ''  # stop retrying it every run
+        self.save()
+
+    def fill(self, items):
+        "Sets padded_img of items that got one from the backfill, returns how many did"
+        count = 0
+        for item in items:
+            if not item['padded_img'] and self.images.get(item['url_hash']):
+                item['padded_img'] = self.images[item['url_hash']]
+                count += 1
+        return count
+
+
+# image probes and og lookups close the connection early, so no requests_cache here: it would read whole bodies
+scrape_session = requests.Session()
 scrape_session.headers.update({'User-Agent': USER_AGENT})
 
 
 class FeedProcessor():
-    def __init__(self):
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or config.CONCURRENCY  # workers of the pools this processor makes
         self.queue = Queue()
         self.h2t = html2text.HTML2Text()
         self.h2t.ignore_links = True
         self.report = {}  # holds reports and stats of all actions
         self.feeds = {}
+        self.links = {}  # feed url -> {link: processed entry} of the last process_rss
+        self.pool = None  # set to keep one pool of workers for all stages, otherwise each stage makes its own
 
     if not os.path.isdir('feed'):
         os.mkdir('feed')
 
+    @contextmanager
+    def worker_pool(self):
+        if self.pool:
+            yield self.pool
+        else:
+            with multiprocessing.Pool(self.concurrency) as pool:
+                yield pool
+
+    def count_pickle_bytes(self, stage, obj):
+        "Adds the size of obj, as sent between processes, to the report for stage"
+        if not config.REPORT_PICKLE_BYTES:
+            return
+        pickle_bytes = self.report.setdefault('pickle_bytes', {})
+        pickle_bytes[stage] = pickle_bytes.get(stage, 0) + len(ForkingPickler.dumps(obj))
+
+    def image_feeds(self, items):
+        "Workers only need to know which publishers of items want og images"
+        return {item['publisher_id']: {'og_images': self.feeds[item['publisher_id']]['og_images']} for item in items}
+
     def check_images(self, items):
-        out_items = []
-        logging.info("Checking images for %s items...", len(items))
-        with multiprocessing.Pool(config.CONCURRENCY) as pool:
-            for item in pool.imap(partial(check_images_in_item, feeds=self.feeds), items):
-                out_items.append(item)
-
-        logging.info("Caching images for %s items...", len(out_items))
-        with multiprocessing.Pool(config.CONCURRENCY) as pool:
-            result = []
-            for item in pool.imap(process_image, out_items):
+        result = []
+        logging.info("Checking and caching images for %s items...", len(items))
+        check = partial(check_and_process_image, feeds=self.image_feeds(items))
+        for item in items:
+            self.count_pickle_bytes('images', (check, item))
+        with self.worker_pool() as pool:
+            for item in pool.imap(check, items):
+                self.count_pickle_bytes('images', item)
                 result.append(item)
-            return result
+        return result
 
     def download_feeds(self, my_feeds):
         feed_cache = {}
         logging.info("Downloading %s feeds...", len(my_feeds))
-        with multiprocessing.Pool(config.CONCURRENCY) as pool:
-            for result in pool.imap(download_feed, [my_feeds[key]['url'] for key in my_feeds]):
+        args = [(my_feeds[key]['url'], my_feeds[key]['max_entries']) for key in my_feeds]
+        for task in args:
+            self.count_pickle_bytes('download', (download_feed, task))
+        with self.worker_pool() as pool:
+            for result in pool.starmap(download_feed, args):
                 if not result:
                     continue
+                self.count_pickle_bytes('download', result)
                 self.report['feed_stats'][result['key']] = result['report']
                 feed_cache[result['key']] = result['feed_cache']
                 self.feeds[my_feeds[result['key']]['publisher_id']] = my_feeds[result['key']]
         return feed_cache
 
-    def get_rss(self, my_feeds):
+    def get_rss(self, my_feeds, known=None):
+        "Downloads and fixes up the entries of my_feeds, except those whose link is in known"
+        source_registry.compile_registry(my_feeds)
+        known = known or {}
         self.feeds = {}
+        self.links = {}
         entries = []
         self.report['feed_stats'] = {}
+        self.report.pop('pickle_bytes', None)
         feed_cache = self.download_feeds(my_feeds)
 
         logging.info("Fixing up and extracting the data for the items in %s feeds...", len(feed_cache))
-        for key in feed_cache:
-            with multiprocessing.Pool(config.CONCURRENCY) as pool:
-                for out_item in pool.imap(partial(fixup_item, my_feed=my_feeds[key]),
-                                          feed_cache[key]['entries'][:my_feeds[key]['max_entries']]):
+        with self.worker_pool() as pool:
+            for key in feed_cache:
+                links = self.links[key] = {}
+                items = []
+                for item in feed_cache[key]['entries'][:my_feeds[key]['max_entries']]:
+                    if item.link in known.get(key, {}):
+                        links[item.link] = known[key][item.link]  # processed by an earlier call
+                        self.report['feed_stats'][key]['size_after_insert'] += 1
+                    else:
+                        items.append(item)
+                fixup = partial(fixup_item, my_feed=my_feeds[key])
+                for item in items:
+                    self.count_pickle_bytes('fixup', (fixup, item))
+                for item, out_item in zip(items, pool.imap(fixup, items)):
+                    self.count_pickle_bytes('fixup', out_item)
                     if out_item:
                         entries.append(out_item)
+                        links[item.link] = out_item
                     self.report['feed_stats'][key]['size_after_insert'] += 1
         return entries
 
@@ -327,16 +506,54 @@ class FeedProcessor():
         return out_entries
 
     def aggregate_rss(self, feeds):
+        return self.merge_entries([self.process_rss(feeds)])
+
+    def process_rss(self, feeds, backfill=None, known=None):
+        """Runs the stages that don't need the entries of other feeds: download, fixup, images and scrubbing.
+
+        With a backfill, the image stage is deferred to it instead. Entries whose link is in
+        known, the links of an earlier call for the same feeds, are returned as they were
+        processed then. Afterwards self.links maps the links of every downloaded feed to its entries.
+        """
+        known = known or {}
         entries = []
-        entries += self.get_rss(feeds)
+        entries += self.get_rss(feeds, known)
         sorted_entries = sorted(entries, key=lambda entry: entry["publish_time"])
         sorted_entries.reverse()  # for most recent entries first
-        filtered_entries = self.fixup_entries(sorted_entries)
+        filtered_entries = self.fixup_entries(sorted_entries, check_images=backfill is None)
+        if backfill is not None:
+            backfill.defer(filtered_entries, self)
         filtered_entries = self.scrub_html(filtered_entries)
-        filtered_entries = self.score_entries(filtered_entries)
+
+        # the image stage returns copies, find the final entry of each link by url_hash
+        by_url_hash = {entry['url_hash']: entry for entry in filtered_entries}
+        for key, links in self.links.items():
+            for link, entry in list(links.items()):
+                if known.get(key, {}).get(link) is entry:
+                    filtered_entries.append(entry)
+                elif entry.get('url_hash') in by_url_hash:
+                    links[link] = by_url_hash[entry['url_hash']]
+                else:
+                    del links[link]  # dropped by fixup_entries
+        self.report['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        logging.info("Bytes pickled per stage: %s, peak RSS: %s KB", self.report.get('pickle_bytes'),
+                     self.report['peak_rss_kb'])
         return filtered_entries
 
-    def fixup_entries(self, sorted_entries):
+    def merge_entries(self, partitions):
+        "Dedupes, sorts and scores the processed entries of one or more partitions"
+        entries = [entry for partition in partitions for entry in partition]
+        sorted_entries = sorted(entries, key=lambda entry: entry["publish_time"], reverse=True)
+        url_dedupe = {}
+        out = []
+        for item in sorted_entries:
+            if item['url'] in url_dedupe:
+                continue  # skip (same article in another partition)
+            out.append(item)
+            url_dedupe[item['url']] = True
+        return self.score_entries(out)
+
+    def fixup_entries(self, sorted_entries, check_images=True):
         " this function tends to be used more for fixups that require the whole feed like dedupe"
         url_dedupe = {}
         out = []
@@ -348,7 +565,7 @@ class FeedProcessor():
             parts = parts._replace(path=quote(parts.path))
             encoded_url = urlunparse(parts)
             if item['content_type'] != 'product':
-                if item['publish_time'] > now_utc or item['publish_time'] < (now_utc - timedelta(days=60)):
+                if item['publish_time'] > now_utc or item['publish_time'] < (now_utc - MAX_ENTRY_AGE):
                     if item['content_type'] != 'product':
                         continue  # skip (newer than now() or older than 1 month)
             if encoded_url in url_dedupe:
@@ -363,7 +580,8 @@ class FeedProcessor():
             item['url_hash'] = url_hash
             out.append(item)
             url_dedupe[encoded_url] = True
-        out = self.check_images(out)
+        if check_images:
+            out = self.check_images(out)
         return out
 
     def scrub_html(self, feed):
@@ -382,6 +600,75 @@ class FeedProcessor():
         with open(out_fn, 'w') as f:
             f.write(json.dumps(self.aggregate_rss(feeds)))
 
+    def aggregate_publish_first(self, feeds, category):
+        """Publishes feed/<category>.json before any image work, reusing the images of earlier runs.
+
+        The rest of the images are then backfilled, and the feed published again
+        when the backfill is done or BACKFILL_DEADLINE has passed.
+        """
+        self.feeds = feeds
+        backfill = ImageBackfill(category)
+        entries = self.merge_entries([self.process_rss(feeds, backfill)])
+        with open("feed/%s.json-tmp" % (category), 'w') as f:
+            f.write(json.dumps(entries))
+        publish_feed(category)
+        backfill.save()
+
+        backfill.drain(self, time.time() + config.BACKFILL_DEADLINE)
+        if backfill.fill(entries):
+            with open("feed/%s.json-tmp" % (category), 'w') as f:
+                f.write(json.dumps(entries))
+            publish_feed(category)
+
+    def aggregate_partition(self, feeds, partition, partition_count, out_fn, run_id=None):
+        "Processes this partition's share of feeds and writes the entries and report for merge_partitions"
+        feeds = partition_feeds(feeds, partition, partition_count)
+        self.feeds = feeds
+        entries = self.process_rss(feeds)
+        result = {'partition': partition, 'partition_count': partition_count, 'run_id': run_id,
+                  'generated_at': time.time(), 'entries': entries, 'report': self.report}
+        pathlib.Path(os.path.dirname(out_fn)).mkdir(parents=True, exist_ok=True)
+        with open("%s-tmp" % (out_fn), 'w') as f:
+            f.write(json.dumps(result))
+        os.replace("%s-tmp" % (out_fn), out_fn)  # the merge must never see a partial file
+
+    def aggregate_partitions(self, feeds, partition_count, out_fns, run_id):
+        "Runs every partition in its own process on this host, each with its share of this processor's workers"
+        concurrency = max(1, self.concurrency // partition_count)
+        processes = []
+        for partition in range(partition_count):
+            process = multiprocessing.Process(target=run_partition,
+                                              args=(concurrency, feeds, partition, partition_count,
+                                                    out_fns[partition], run_id))
+            process.start()
+            processes.append(process)
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError("Partition process failed with exit code %s" % (process.exitcode))
+
+    def merge_partitions(self, partition_fns, out_fn, run_id=None):
+        "Raises StalePartition rather than publish results left over from an earlier run"
+        partitions = []
+        self.report = {'feed_stats': {}}
+        for partition, partition_fn in enumerate(partition_fns):
+            with open(partition_fn) as f:
+                result = json.loads(f.read())
+            if result['partition'] != partition or result['partition_count'] != len(partition_fns):
+                raise StalePartition("%s is partition %s of %s" % (partition_fn, result['partition'],
+                                                                   result['partition_count']))
+            if run_id and result.get('run_id') != run_id:
+                raise StalePartition("%s is from run %s, not %s" % (partition_fn, result.get('run_id'), run_id))
+            if time.time() - result.get('generated_at', 0) > config.PARTITION_MAX_AGE:
+                raise StalePartition("%s is older than %s seconds" % (partition_fn, config.PARTITION_MAX_AGE))
+            partitions.append(result['entries'])
+            self.report['feed_stats'].update(result['report']['feed_stats'])
+            for stage, size in result['report'].get('pickle_bytes', {}).items():
+                pickle_bytes = self.report.setdefault('pickle_bytes', {})
+                pickle_bytes[stage] = pickle_bytes.get(stage, 0) + size
+        with open(out_fn, 'w') as f:
+            f.write(json.dumps(self.merge_entries(partitions)))
+
     def aggregate_shards(self, feeds):
         by_category = {}
         for item in self.aggregate_rss(feeds):
@@ -394,6 +681,24 @@ class FeedProcessor():
                 f.write(json.dumps(by_category[key]))
 
 
+def run_partition(concurrency, feeds, partition, partition_count, out_fn, run_id):
+    "Entry point of the partition processes started by aggregate_partitions"
+    FeedProcessor(concurrency).aggregate_partition(feeds, partition, partition_count, out_fn, run_id)
+
+
+def publish_feed(category):
+    "Moves the freshly written feed/<category>.json-tmp into place and uploads it"
+    shutil.copyfile("feed/%s.json-tmp" % (category), "feed/%s.json" % (category))
+    if not config.NO_UPLOAD:
+        upload_file("feed/%s.json" % (category), config.PUB_S3_BUCKET,
+                    "brave-today/%s%s.json" % (category, config.SOURCES_FILE.strip("sources")))
+        # Temporarily upload also with incorrect filename as a stopgap for
+        # https://github.com/brave/brave-browser/issues/20114
+        # Can be removed once fixed in the brave-core client for all Desktop users.
+        upload_file("feed/%s.json" % (category), config.PUB_S3_BUCKET,
+                    "brave-today/%s%sjson" % (category, config.SOURCES_FILE.strip("sources")))
+
+
 fp = FeedProcessor()
 
 if __name__ == '__main__':
@@ -403,15 +708,28 @@ if __name__ == '__main__':
         category = 'feed'
     with open("%s.json" % (category)) as f:
         feeds = json.loads(f.read())
-        fp.aggregate(feeds, "feed/%s.json-tmp" % (category))
-        shutil.copyfile("feed/%s.json-tmp" % (category), "feed/%s.json" % (category))
-        if not config.NO_UPLOAD:
-            upload_file("feed/%s.json" % (category), config.PUB_S3_BUCKET,
-                        "brave-today/%s%s.json" % (category, config.SOURCES_FILE.strip("sources")))
-            # Temporarily upload also with incorrect filename as a stopgap for
-            # https://github.com/brave/brave-browser/issues/20114
-            # Can be removed once fixed in the brave-core client for all Desktop users.
-            upload_file("feed/%s.json" % (category), config.PUB_S3_BUCKET,
-                        "brave-today/%s%sjson" % (category, config.SOURCES_FILE.strip("sources")))
+    partition_fns = [partition_path(category, partition, config.PARTITION_COUNT)
+                     for partition in range(config.PARTITION_COUNT)]
+    if config.PUBLISH_FIRST and config.PARTITION_COUNT > 1:
+        logging.error("PUBLISH_FIRST can't be combined with PARTITION_COUNT > 1.")
+        sys.exit(1)
+    if config.PARTITION_COUNT > 1 and config.PARTITION not in (None, 'merge'):
+        # a single node's share, the node running the merge uploads the feed
+        partition = int(config.PARTITION)
+        fp.aggregate_partition(feeds, partition, config.PARTITION_COUNT, partition_fns[partition],
+                               config.PARTITION_RUN_ID)
+        sys.exit(0)
+    if config.PUBLISH_FIRST:
+        fp.aggregate_publish_first(feeds, category)  # publishes by itself, once or twice
+    else:
+        if config.PARTITION_COUNT > 1:
+            run_id = config.PARTITION_RUN_ID
+            if config.PARTITION is None:
+                run_id = run_id or uuid.uuid4().hex
+                fp.aggregate_partitions(feeds, config.PARTITION_COUNT, partition_fns, run_id)
+            fp.merge_partitions(partition_fns, "feed/%s.json-tmp" % (category), run_id)
+        else:
+            fp.aggregate(feeds, "feed/%s.json-tmp" % (category))
+        publish_feed(category)
     with open("report.json", 'w') as f:
         f.write(json.dumps(fp.report))
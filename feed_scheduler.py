@@ -0,0 +1,131 @@
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+import config
+from feed_processor_multi import MAX_ENTRY_AGE, FeedProcessor, publish_feed
+
+HISTORY_SIZE = 50  # publish times kept per feed to learn its interval from
+RETRY_DELAY = 60  # seconds to wait after a pass failed
+
+
+def refresh_interval(publish_times, now):
+    "Half the median gap between a feed's recent articles and now, within the configured bounds"
+    times = sorted(publish_times)[-HISTORY_SIZE:] + [now]
+    if len(times) < 2:
+        return config.REFRESH_MIN_INTERVAL  # nothing to learn from yet
+    gaps = sorted((later - earlier).total_seconds() for earlier, later in zip(times, times[1:]))
+    median_gap = gaps[len(gaps) // 2]
+    return min(config.REFRESH_MAX_INTERVAL, max(config.REFRESH_MIN_INTERVAL, median_gap / 2))
+
+
+class FeedScheduler():
+    """Keeps the entries of every feed resident and refreshes each feed on its own interval.
+
+    The category output is republished when enough new articles came in, or when
+    REPUBLISH_DEADLINE has passed since the last publish.
+    """
+
+    def __init__(self, category, processor):
+        self.category = category
+        self.fp = processor
+        self.feeds = {}
+        self.feeds_mtime = None
+        self.next_refresh = {}  # feed url -> unix time it's due
+        self.entries = {}  # feed url -> {link: processed entry} of its last successful refresh
+        self.history = {}  # feed url -> publish times seen
+        self.published_urls = set()
+        self.pending_urls = set()  # new since the last publish
+        self.last_publish = 0
+        self.report = {'feed_stats': {}}
+
+    def load_feeds(self):
+        "(Re)loads <category>.json when it changed, new feeds are due right away"
+        path = "%s.json" % (self.category)
+        mtime = os.stat(path).st_mtime
+        if mtime == self.feeds_mtime:
+            return
+        with open(path) as f:
+            try:
+                feeds = json.loads(f.read())
+            except ValueError as e:
+                # csv_to_json may be halfway through writing it, keep the current feeds and retry next pass
+                logging.warning("Not reloading %s: %s", path, e)
+                return
+        for key in set(self.feeds) - set(feeds):
+            for state in (self.next_refresh, self.entries, self.history, self.report['feed_stats']):
+                state.pop(key, None)
+        for key in feeds:
+            self.next_refresh.setdefault(key, 0)
+        self.feeds = feeds
+        self.feeds_mtime = mtime
+        logging.info("Scheduling %s feeds.", len(feeds))
+
+    def refresh(self, due):
+        "Only links not seen in the last refresh of a feed go through fixup and the image stage"
+        logging.info("Refreshing %s feeds...", len(due))
+        self.fp.process_rss(due, known={key: self.entries[key] for key in due if key in self.entries})
+        self.report['feed_stats'].update(self.fp.report['feed_stats'])
+
+        now = datetime.utcnow()
+        for key in due:
+            if key in self.fp.report['feed_stats']:  # downloaded, otherwise keep the entries of the last download
+                self.entries[key] = self.fp.links.get(key, {})
+                entries = self.entries[key].values()
+                self.pending_urls.update(entry['url'] for entry in entries if entry['url'] not in self.published_urls)
+                history = self.history.setdefault(key, set())
+                history.update(datetime.strptime(entry['publish_time'], '%Y-%m-%d %H:%M:%S') for entry in entries)
+                self.history[key] = set(sorted(history)[-HISTORY_SIZE:])
+            self.next_refresh[key] = time.time() + refresh_interval(self.history.get(key, ()), now)
+
+    def publish(self):
+        logging.info("Publishing %s with %s new articles...", self.category, len(self.pending_urls))
+        # entries kept from earlier refreshes age too
+        oldest = (datetime.utcnow() - MAX_ENTRY_AGE).strftime('%Y-%m-%d %H:%M:%S')
+        entries = self.fp.merge_entries([[entry for entry in links.values()
+                                          if entry['content_type'] == 'product' or entry['publish_time'] >= oldest]
+                                         for links in self.entries.values()])
+        with open("feed/%s.json-tmp" % (self.category), 'w') as f:
+            f.write(json.dumps(entries))
+        publish_feed(self.category)
+        with open("report.json", 'w') as f:
+            f.write(json.dumps(self.report))
+        self.published_urls = {entry['url'] for entry in entries}
+        self.pending_urls = set()
+        self.last_publish = time.time()
+
+    def run_once(self):
+        self.load_feeds()
+        due = {key: self.feeds[key] for key in self.feeds if self.next_refresh[key] <= time.time()}
+        if due:
+            self.refresh(due)
+        if len(self.pending_urls) >= config.REPUBLISH_MIN_CHANGES or \
+                time.time() - self.last_publish >= config.REPUBLISH_DEADLINE:
+            self.publish()
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error("Scheduler pass failed [%s]: %s", e.__class__.__name__, e)
+                time.sleep(RETRY_DELAY)
+                continue
+            wake_up = min(list(self.next_refresh.values()) + [self.last_publish + config.REPUBLISH_DEADLINE])
+            time.sleep(min(60, max(1, wake_up - time.time())))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        category = sys.argv[1]
+    else:
+        category = 'feed'
+    # one pool for the lifetime of the daemon, its workers keep their sessions and caches warm
+    with multiprocessing.Pool(config.CONCURRENCY) as pool:
+        fp = FeedProcessor()
+        fp.pool = pool
+        FeedScheduler(category, fp).run()
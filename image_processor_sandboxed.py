@@ -2,6 +2,8 @@ import hashlib
 import logging
 import os
 import pathlib
+import re
+import struct
 import sys
 from io import BytesIO
 
@@ -22,6 +24,14 @@ wasm_path = 'wasm_thumbnail.wasm'
 wasm_store = Store(engine.JIT(Compiler))
 wasm_module = Module(wasm_store, open(wasm_path, 'rb').read())
 
+IMAGE_MAX_BYTES = 5000000  # 5mb max
+IMAGE_MIN_WIDTH = 200
+IMAGE_MIN_HEIGHT = 100
+IMAGE_PROBE_BYTES = 32768  # enough for the header of nearly every jpeg we see
+
+# SOFn markers carry the frame dimensions; C4 (DHT), C8 (JPG) and CC (DAC) don't.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
 
 def resize_and_pad_image(image_bytes, width, height, size, cache_path):
     pathlib.Path(os.path.dirname(cache_path)).mkdir(parents=True, exist_ok=True)
@@ -71,20 +81,113 @@ def get_with_max_size(url, max_bytes):
     return content.getvalue()
 
 
+def get_jpeg_size(data):
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None  # lost sync with the marker stream
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1  # fill byte
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2  # standalone markers have no length
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+    return None
+
+
+def get_image_size(data):
+    """Returns (format, width, height) parsed from the first bytes of an image.
+
+    width and height are None if the format is recognised but the dimensions
+    aren't within data. Returns None for formats wasm_thumbnail can't decode."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            return 'png', None, None
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            return 'gif', None, None
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'gif', width, height
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ' and len(data) >= 30:
+            width, height = struct.unpack('<HH', data[26:30])
+            return 'webp', width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L' and len(data) >= 25:
+            bits = struct.unpack('<I', data[21:25])[0]
+            return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X' and len(data) >= 30:
+            width = int.from_bytes(data[24:27], 'little') + 1
+            height = int.from_bytes(data[27:30], 'little') + 1
+            return 'webp', width, height
+        return 'webp', None, None
+    if data[:2] == b'\xff\xd8':
+        size = get_jpeg_size(data)
+        if size:
+            return ('jpeg',) + size
+        return 'jpeg', None, None
+    return None
+
+
+def probe_image(url, session=requests):
+    """Fetches only the first IMAGE_PROBE_BYTES of an image to check it's worth caching.
+
+    Raises ValueError if the image is of an unsupported format, too small or too large."""
+    response = session.get(url, headers={'Range': 'bytes=0-%s' % (IMAGE_PROBE_BYTES - 1)}, stream=True,
+                           timeout=5)
+    try:
+        response.raise_for_status()
+
+        # prefer the total from Content-Range, servers ignoring Range send the whole length
+        match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        if match:
+            total_size = int(match.group(1))
+        elif response.status_code == 200 and response.headers.get('Content-Length'):
+            total_size = int(response.headers.get('Content-Length'))
+        else:
+            total_size = 0
+        if total_size > IMAGE_MAX_BYTES:
+            raise ValueError('Content-Length too large')
+
+        content = BytesIO()
+        for chunk in response.iter_content(4096):
+            content.write(chunk)
+            if content.tell() >= IMAGE_PROBE_BYTES:
+                break
+    finally:
+        response.close()  # don't drain the rest of the body if Range was ignored
+
+    result = get_image_size(content.getvalue())
+    if not result:
+        raise ValueError('Unsupported image format')
+    image_format, width, height = result
+    if width is not None and (width < IMAGE_MIN_WIDTH or height < IMAGE_MIN_HEIGHT):
+        raise ValueError('Image too small (%sx%s)' % (width, height))
+    return result
+
+
 class ImageProcessor():
     def __init__(self, s3_bucket=None):
         self.s3_bucket = s3_bucket
+        self.cached = set()  # cache_fns known to exist, so cache_image doesn't ask s3 again after is_cached
 
-    def cache_image(self, url):
+    def is_cached(self, url):
+        "True if the padded image of url is in the local cache or on s3, None if s3 couldn't tell"
         cache_fn = "%s.jpg" % (hashlib.sha256(url.encode('utf-8')).hexdigest())
-        cache_path = "./feed/cache/%s" % (cache_fn)
-
+        if cache_fn in self.cached:
+            return True
         # if we have it dont do it again
-        if os.path.isfile(cache_path):
-            return cache_fn
+        if os.path.isfile("./feed/cache/%s" % (cache_fn)):
+            exists = True
         # also check if we have it on s3
-        if not config.NO_UPLOAD:
-            exists = False
+        elif not config.NO_UPLOAD:
             try:
                 s3_resource.Object(self.s3_bucket, "brave-today/cache/%s.pad" % (cache_fn)).load()
                 exists = True
@@ -95,11 +198,24 @@ class ImageProcessor():
                     exists = False
                 else:
                     return None  # should retry
-            if exists:
-                return cache_fn
+        else:
+            exists = False
+        if exists:
+            self.cached.add(cache_fn)
+        return exists
+
+    def cache_image(self, url):
+        cache_fn = "%s.jpg" % (hashlib.sha256(url.encode('utf-8')).hexdigest())
+        cache_path = "./feed/cache/%s" % (cache_fn)
+
+        cached = self.is_cached(url)
+        if cached:
+            return cache_fn
+        if cached is None:
+            return None  # should retry
 
         try:
-            content = get_with_max_size(url, 5000000)  # 5mb max
+            content = get_with_max_size(url, IMAGE_MAX_BYTES)
         except requests.exceptions.ReadTimeout:
             return None
         except ValueError:
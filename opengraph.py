@@ -0,0 +1,91 @@
+import codecs
+import functools
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+MAX_HEAD_BYTES = 262144  # stop reading pages whose <head> never ends
+
+# in order of preference
+IMAGE_META_PROPERTIES = ('og:image', 'og:image:url', 'og:image:secure_url', 'twitter:image', 'twitter:image:src')
+IMAGE_LINK_RELS = ('image_src',)
+
+
+class HeadParser(HTMLParser):
+    "Collects image meta and link tags, and notices where the <head> ends"
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.images = {}
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return  # the rest of the chunk that ended the head
+        if tag == 'body':
+            self.done = True
+            return
+        attrs = dict(attrs)
+        if tag == 'meta':
+            key = (attrs.get('property') or attrs.get('name') or '').strip().lower()
+            if key in IMAGE_META_PROPERTIES and attrs.get('content'):
+                self.images.setdefault(key, attrs['content'].strip())
+        elif tag == 'link':
+            for rel in (attrs.get('rel') or '').lower().split():
+                if rel in IMAGE_LINK_RELS and attrs.get('href'):
+                    self.images.setdefault(rel, attrs['href'].strip())
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+    def get_image(self):
+        for key in IMAGE_META_PROPERTIES + IMAGE_LINK_RELS:
+            if self.images.get(key):
+                return self.images[key]
+        return None
+
+
+def parse_head_image(chunks, encoding='utf-8', max_bytes=MAX_HEAD_BYTES):
+    "Feeds chunks of a page into HeadParser until </head> or max_bytes, returns the image url found"
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    parser = HeadParser()
+    count = 0
+    for chunk in chunks:
+        count += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or count >= max_bytes:
+            break
+    return parser.get_image()
+
+
+@functools.lru_cache(maxsize=4096)
+def get_og_image(url, session=requests, timeout=5):
+    """Returns the absolute og/twitter/link-rel image url of a page, or "" if it has none.
+
+    Only the <head> of the page is downloaded. Raises requests' HTTPError on bad status.
+    """
+    response = session.get(url, stream=True, timeout=timeout)
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if 'html' not in content_type:
+            return ""
+        if 'charset' in content_type and response.encoding:
+            encoding = response.encoding
+        else:
+            encoding = 'utf-8'
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            encoding = 'utf-8'
+        image = parse_head_image(response.iter_content(8192), encoding)
+    finally:
+        response.close()  # don't drain the rest of the page
+    if not image:
+        return ""
+    return urljoin(response.url, image)
@@ -0,0 +1,55 @@
+import re
+
+import bleach
+
+DOMAIN_RE = re.compile(r'^(?=.{1,253}$)([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?\.)*[a-z0-9-]{1,63}$')
+# the only characters bleach.clean changes on their own: markup, and control characters other than \t and \n
+BLEACH_CHANGES_RE = re.compile(r'[&<>\x00-\x08\x0b-\x1f]')
+
+
+def clean_cell(value):
+    "bleach.clean is slow, and a no-op on cells without the characters it changes"
+    if BLEACH_CHANGES_RE.search(value):
+        return bleach.clean(value, strip=True)
+    return value
+
+
+def normalize_domain(domain):
+    domain = domain.strip().lower().rstrip('.')
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    return domain
+
+
+def compile_domains(domains):
+    """Returns the set of destination domains for a source.
+
+    Accepts the ';'-joined string from the sources CSV or an iterable of
+    domains. A leading www. is dropped, it is matched like any other subdomain.
+    """
+    if isinstance(domains, frozenset):
+        return domains
+    if isinstance(domains, str):
+        domains = domains.split(';')
+    return frozenset(normalize_domain(domain) for domain in domains if domain.strip())
+
+
+def is_valid_domain(domain):
+    return bool(DOMAIN_RE.match(domain))
+
+
+def domain_allowed(hostname, domains):
+    "True if hostname is one of domains or a subdomain of one, checking one suffix per label"
+    hostname = (hostname or '').lower().rstrip('.')
+    while hostname:
+        if hostname in domains:
+            return True
+        _, _, hostname = hostname.partition('.')
+    return False
+
+
+def compile_registry(feeds):
+    "Replaces destination_domains in every source of feeds with its compiled set, in place"
+    for feed in feeds.values():
+        feed['destination_domains'] = compile_domains(feed.get('destination_domains') or ())
+    return feeds
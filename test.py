@@ -1,9 +1,20 @@
+import hashlib
 import json
 import os
+import struct
+import time
+from datetime import datetime, timedelta
+from multiprocessing.reduction import ForkingPickler
 
+import bleach
 import feedparser
 
+import config
 import feed_processor_multi
+import feed_scheduler
+import image_processor_sandboxed
+import opengraph
+import source_registry
 
 
 # def test_image_processor():
@@ -12,6 +23,83 @@ import feed_processor_multi
 #     assert result
 #     assert os.stat("feed/cache/%s.pad" % (result)).st_size != 0
 
+def test_get_image_size():
+    with open('test.png', 'rb') as f:
+        assert image_processor_sandboxed.get_image_size(f.read(1024)) == ('png', 654, 768)
+    assert image_processor_sandboxed.get_image_size(b'GIF89a\x01\x00\x01\x00\x80\x00') == ('gif', 1, 1)
+    assert image_processor_sandboxed.get_image_size(b'<svg xmlns="http://www.w3.org/2000/svg"/>') is None
+
+def jpeg_header(sof_marker, width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof = sof_marker + struct.pack('>HBHHB', 11, 8, height, width, 3) + b'\x00' * 6
+    return b'\xff\xd8' + app0 + sof
+
+def test_get_image_size_jpeg_webp():
+    assert image_processor_sandboxed.get_image_size(jpeg_header(b'\xff\xc0', 640, 480)) == ('jpeg', 640, 480)
+    assert image_processor_sandboxed.get_image_size(jpeg_header(b'\xff\xc2', 1200, 800)) == ('jpeg', 1200, 800)
+    # a huge APP1 (exif) pushes SOF past the probed bytes
+    assert image_processor_sandboxed.get_image_size(b'\xff\xd8\xff\xe1\xff\xf0' + b'\x00' * 100) == \
+        ('jpeg', None, None)
+
+    riff = b'RIFF\x00\x00\x00\x00WEBP'
+    vp8 = riff + b'VP8 ' + b'\x00' * 4 + b'\x00' * 3 + b'\x9d\x01\x2a' + struct.pack('<HH', 800, 600)
+    assert image_processor_sandboxed.get_image_size(vp8) == ('webp', 800, 600)
+    vp8l = riff + b'VP8L' + b'\x00' * 4 + b'\x2f' + struct.pack('<I', 1023 | (767 << 14))
+    assert image_processor_sandboxed.get_image_size(vp8l) == ('webp', 1024, 768)
+    vp8x = riff + b'VP8X' + b'\x00' * 8 + (1919).to_bytes(3, 'little') + (1079).to_bytes(3, 'little')
+    assert image_processor_sandboxed.get_image_size(vp8x) == ('webp', 1920, 1080)
+
+class StubResponse():
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.read = 0
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        while self.read < len(self.content):
+            self.read += chunk_size
+            yield self.content[self.read - chunk_size:self.read]
+
+    def close(self):
+        pass
+
+class StubSession():
+    def __init__(self, response):
+        self.response = response
+        self.headers = None
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.headers = headers
+        return self.response
+
+def test_probe_image():
+    image = jpeg_header(b'\xff\xc0', 1168, 657) + b'\x00' * 100000
+
+    # server honouring Range: the total size comes from Content-Range
+    response = StubResponse(206, {'Content-Range': 'bytes 0-32767/%s' % len(image)},
+                            image[:image_processor_sandboxed.IMAGE_PROBE_BYTES])
+    session = StubSession(response)
+    assert image_processor_sandboxed.probe_image('https://brave.com/a.jpg', session) == ('jpeg', 1168, 657)
+    assert session.headers['Range'] == 'bytes=0-%s' % (image_processor_sandboxed.IMAGE_PROBE_BYTES - 1)
+
+    # server ignoring Range: stop reading after IMAGE_PROBE_BYTES
+    response = StubResponse(200, {'Content-Length': str(len(image))}, image)
+    assert image_processor_sandboxed.probe_image('https://brave.com/a.jpg', StubSession(response))
+    assert response.read == image_processor_sandboxed.IMAGE_PROBE_BYTES
+
+    for response in (StubResponse(206, {'Content-Range': 'bytes 0-32767/6000000'}, image[:32768]),
+                     StubResponse(200, {'Content-Length': '6000000'}, image),
+                     StubResponse(200, {}, jpeg_header(b'\xff\xc0', 150, 150))):
+        try:
+            image_processor_sandboxed.probe_image('https://brave.com/a.jpg', StubSession(response))
+            assert False
+        except ValueError:
+            pass
+
 def test_feed_processor_download():
     result = feed_processor_multi.download_feed('https://brave.com/blog/index.xml')
     assert result
@@ -28,6 +116,14 @@ def test_feed_processor_aggregate():
     assert data
     assert len(data) != 0
 
+def test_feed_entry():
+    item = feedparser.parse('test.rss')['items'][0]
+    entry = feed_processor_multi.FeedEntry(item)
+    assert entry.img == item['media_content'][0]['url']
+    assert entry.link == item['link']
+    assert entry.title == item['title']
+    assert len(ForkingPickler.dumps(entry)) < len(ForkingPickler.dumps(item))
+
 def test_check_images():
     data = [feedparser.parse('test.rss')['items'][0]]
     data[0]['img'] = data[0]['media_content'][0]['url']
@@ -103,3 +199,201 @@ def test_score_entries():
     filtered_entries = fp.score_entries(filtered_entries)
 
     assert filtered_entries
+
+def test_og_image():
+    head = b'<html><head><meta name="twitter:image" content="/t.jpg"><meta property="og:image" content="/og.jpg" />'
+    body = b'</head><body><meta property="og:image" content="/body.jpg"></body></html>'
+    assert opengraph.parse_head_image([head, body]) == '/og.jpg'
+    assert opengraph.parse_head_image([b'<head><link rel="image_src" href="/l.jpg">', b'<body>']) == '/l.jpg'
+    assert opengraph.parse_head_image([b'<head><title>No image</title></head>']) is None
+    after_head = b'<head><title>x</title></head><body><meta property="og:image" content="/body.jpg">'
+    assert opengraph.parse_head_image([after_head]) is None
+    assert opengraph.parse_head_image([b'<head><title>x</title><body><link rel="image_src" href="/b.jpg">']) is None
+
+def test_domain_allowed():
+    domains = source_registry.compile_domains('www.cnn.com;edition.cnn.com')
+    assert domains == {'cnn.com', 'edition.cnn.com'}
+    assert source_registry.domain_allowed('www.cnn.com', domains)
+    assert source_registry.domain_allowed('money.cnn.com', domains)
+    assert not source_registry.domain_allowed('notcnn.com', domains)
+    assert not source_registry.domain_allowed('cnn.com.evil.net', domains)
+    assert not source_registry.domain_allowed(None, domains)
+
+def test_clean_cell():
+    for value in ('CNN', 'https://rss.cnn.com/rss/cnn_topstories.rss', 'a\tb', '日本経済新聞',
+                  'a & b', '<b>CNN</b>', 'line\rbreak', 'nul\x00byte', 'x\x1fy'):
+        assert source_registry.clean_cell(value) == bleach.clean(value, strip=True)
+
+def test_partition_feeds():
+    with open('test.json') as f:
+        feeds = json.loads(f.read())
+    partitions = [feed_processor_multi.partition_feeds(feeds, partition, 3) for partition in range(3)]
+    assert sorted(key for partition in partitions for key in partition) == sorted(feeds)
+
+def test_merge_entries():
+    fp = feed_processor_multi.FeedProcessor()
+    old = {'url': 'https://brave.com/a', 'publisher_id': '1', 'publish_time': '2021-01-01 00:00:00'}
+    new = {'url': 'https://brave.com/b', 'publisher_id': '2', 'publish_time': '2021-01-02 00:00:00'}
+    duplicate = dict(old, publisher_id='2')
+    merged = fp.merge_entries([[old], [new, duplicate]])
+    assert [entry['url'] for entry in merged] == ['https://brave.com/b', 'https://brave.com/a']
+    assert all('score' in entry for entry in merged)
+
+def test_refresh_interval():
+    now = datetime(2021, 1, 2)
+    hourly = [now - timedelta(hours=hours) for hours in range(1, 10)]
+    assert feed_scheduler.refresh_interval(hourly, now) == 1800
+    monthly = [now - timedelta(days=30 * months) for months in range(1, 4)]
+    assert feed_scheduler.refresh_interval(monthly, now) == config.REFRESH_MAX_INTERVAL
+    assert feed_scheduler.refresh_interval([], now) == config.REFRESH_MIN_INTERVAL
+
+def scheduler_entry(url, publish_time, content_type='article'):
+    return {'url': url, 'publisher_id': '1', 'content_type': content_type,
+            'publish_time': publish_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def test_scheduler_load_feeds():
+    scheduler = feed_scheduler.FeedScheduler('feed/scheduler', None)
+    for mtime, data in ((1, json.dumps({'a': {}, 'b': {}})), (2, json.dumps({'a': {}})), (3, '{"a": {')):
+        with open('feed/scheduler.json', 'w') as f:
+            f.write(data)
+        os.utime('feed/scheduler.json', (mtime, mtime))
+        scheduler.load_feeds()
+        if mtime == 1:
+            assert scheduler.next_refresh == {'a': 0, 'b': 0}
+            scheduler.next_refresh['a'] = 100
+            scheduler.entries['b'] = {}
+            scheduler.history['b'] = set()
+            scheduler.report['feed_stats']['b'] = {}
+    # b was dropped with all its state, and the half-written file was not loaded
+    assert scheduler.feeds == {'a': {}}
+    assert scheduler.feeds_mtime == 2
+    assert scheduler.next_refresh == {'a': 100}
+    assert not scheduler.entries and not scheduler.history and not scheduler.report['feed_stats']
+
+def test_scheduler_refresh():
+    fp = feed_processor_multi.FeedProcessor()
+    now = datetime.utcnow()
+    seen = scheduler_entry('https://brave.com/seen', now - timedelta(hours=2))
+    new = scheduler_entry('https://brave.com/new', now - timedelta(hours=1))
+    failed = scheduler_entry('https://brave.com/failed', now - timedelta(hours=3))
+    calls = []
+
+    def process_rss(feeds, backfill=None, known=None):
+        calls.append(known)
+        fp.report['feed_stats'] = {'up': {}, 'empty': {}}  # 'down' failed to download
+        fp.links = {'up': dict(known['up'], new=new), 'empty': {}}
+        return [new]
+    fp.process_rss = process_rss
+
+    scheduler = feed_scheduler.FeedScheduler('test', fp)
+    scheduler.entries = {'up': {'seen': seen}, 'down': {'failed': failed}, 'empty': {'seen': seen}}
+    scheduler.published_urls = {seen['url']}
+    scheduler.refresh({'up': {}, 'down': {}, 'empty': {}})
+    assert calls == [{'up': {'seen': seen}, 'down': {'failed': failed}, 'empty': {'seen': seen}}]
+    assert scheduler.entries == {'up': {'seen': seen, 'new': new}, 'down': {'failed': failed}, 'empty': {}}
+    assert scheduler.entries['up']['seen'] is seen
+    assert scheduler.pending_urls == {new['url']}
+    assert all(scheduler.next_refresh[key] > time.time() for key in ('up', 'down', 'empty'))
+
+def test_scheduler_publish(monkeypatch):
+    published = []
+    monkeypatch.setattr(feed_scheduler, 'publish_feed', published.append)
+    now = datetime.utcnow()
+    fresh = scheduler_entry('https://brave.com/fresh', now - timedelta(days=1))
+    stale = scheduler_entry('https://brave.com/stale', now - feed_processor_multi.MAX_ENTRY_AGE - timedelta(days=1))
+    product = scheduler_entry('https://brave.com/product', now - feed_processor_multi.MAX_ENTRY_AGE - timedelta(days=1),
+                              'product')
+    scheduler = feed_scheduler.FeedScheduler('scheduler-test', feed_processor_multi.FeedProcessor())
+    scheduler.load_feeds = lambda: None
+    scheduler.entries = {'a': {'fresh': fresh, 'stale': stale, 'product': product}}
+    scheduler.last_publish = time.time()
+    scheduler.pending_urls = {'https://brave.com/%s' % (i) for i in range(config.REPUBLISH_MIN_CHANGES - 1)}
+    scheduler.run_once()
+    assert not published
+    scheduler.pending_urls.add('https://brave.com/fresh')
+    scheduler.run_once()
+    assert published == ['scheduler-test']
+    assert scheduler.published_urls == {fresh['url'], product['url']}
+    assert not scheduler.pending_urls
+    with open('feed/scheduler-test.json-tmp') as f:
+        assert [entry['url'] for entry in json.loads(f.read())] == [fresh['url'], product['url']]
+
+def test_image_backfill(monkeypatch):
+    monkeypatch.setattr(config, 'NO_UPLOAD', '1')  # only the local image cache
+    backfill = feed_processor_multi.ImageBackfill('test')
+    backfill.queue = {}
+    backfill.images = {'done': 'https://pcdn.brave.software/brave-today/cache/done.jpg.pad', 'gone': 'gone.pad'}
+    items = [{'url_hash': 'done', 'img': 'https://brave.com/a.jpg'}, {'url_hash': 'new', 'img': 'https://brave.com/b.jpg'}]
+    backfill.defer(items, feed_processor_multi.FeedProcessor())
+    assert items[0]['padded_img'] == backfill.images['done']
+    assert items[1]['padded_img'] == ''
+    assert all('img' not in item for item in items)
+    assert backfill.queue['new']['img'] == 'https://brave.com/b.jpg'
+    assert 'gone' not in backfill.images
+
+    backfill.images['new'] = 'https://pcdn.brave.software/brave-today/cache/new.jpg.pad'
+    assert backfill.fill(items) == 1
+    assert items[1]['padded_img'] == backfill.images['new']
+
+def test_image_backfill_uses_cache(monkeypatch):
+    monkeypatch.setattr(config, 'NO_UPLOAD', '1')  # only the local image cache
+    cache_fn = "%s.jpg" % (hashlib.sha256(b'http://brave.com/cached.jpg').hexdigest())
+    os.makedirs('feed/cache', exist_ok=True)
+    with open('feed/cache/%s' % (cache_fn), 'wb') as f:
+        f.write(b'')
+    backfill = feed_processor_multi.ImageBackfill('test')
+    backfill.queue = {'cached': {'url_hash': 'cached', 'img': '//brave.com/cached.jpg'}}
+    backfill.images = {}
+    backfill.attempts = {'cached': 1}
+    items = [{'url_hash': 'cached', 'img': '//brave.com/cached.jpg'}, {'url_hash': 'new', 'img': 'https://brave.com/b.jpg'}]
+    backfill.defer(items, feed_processor_multi.FeedProcessor())
+    assert items[0]['padded_img'] == "%s/brave-today/cache/%s.pad" % (config.PCDN_URL_BASE, cache_fn)
+    assert items[1]['padded_img'] == ''
+    assert list(backfill.queue) == ['new']
+    assert not backfill.attempts
+
+def test_merge_partitions_rejects_stale():
+    fp = feed_processor_multi.FeedProcessor()
+    result = {'partition': 0, 'partition_count': 1, 'run_id': 'old', 'generated_at': 0,
+              'entries': [], 'report': {'feed_stats': {}}}
+    with open('feed/stale-0-of-1.json', 'w') as f:
+        f.write(json.dumps(result))
+    for run_id in ('new', None):
+        try:
+            fp.merge_partitions(['feed/stale-0-of-1.json'], 'feed/stale.json', run_id)
+            assert False
+        except feed_processor_multi.StalePartition:
+            pass
+
+def test_merge_partitions():
+    fp = feed_processor_multi.FeedProcessor()
+    a = {'url': 'https://brave.com/a', 'publisher_id': '1', 'publish_time': '2021-01-01 00:00:00'}
+    b = {'url': 'https://brave.com/b', 'publisher_id': '2', 'publish_time': '2021-01-03 00:00:00'}
+    c = {'url': 'https://brave.com/c', 'publisher_id': '1', 'publish_time': '2021-01-02 00:00:00'}
+    partitions = [([a, c], {'feed_stats': {'feed-1': {'size_after_insert': 2}}, 'pickle_bytes': {'fixup': 10}}),
+                  ([b, dict(a, publisher_id='2')], {'feed_stats': {'feed-2': {'size_after_insert': 2}},
+                                                    'pickle_bytes': {'fixup': 5, 'images': 7}})]
+    partition_fns = []
+    for partition, (entries, report) in enumerate(partitions):
+        partition_fns.append('feed/merge-%s-of-2.json' % (partition))
+        with open(partition_fns[-1], 'w') as f:
+            f.write(json.dumps({'partition': partition, 'partition_count': 2, 'run_id': 'run',
+                                'generated_at': time.time(), 'entries': entries, 'report': report}))
+    fp.merge_partitions(partition_fns, 'feed/merge.json', 'run')
+    with open('feed/merge.json') as f:
+        merged = json.loads(f.read())
+    assert [entry['url'] for entry in merged] == ['https://brave.com/b', 'https://brave.com/c', 'https://brave.com/a']
+    assert all('score' in entry for entry in merged)
+    assert sorted(fp.report['feed_stats']) == ['feed-1', 'feed-2']
+    assert fp.report['pickle_bytes'] == {'fixup': 15, 'images': 7}
+
+def test_image_backfill_gives_up():
+    backfill = feed_processor_multi.ImageBackfill('test')
+    backfill.queue = {}
+    backfill.images = {'bad': ''}
+    backfill.attempts = {'bad': feed_processor_multi.ImageBackfill.MAX_ATTEMPTS}
+    items = [{'url_hash': 'bad', 'img': 'https://brave.com/bad.svg'}]
+    backfill.defer(items, feed_processor_multi.FeedProcessor())
+    assert items[0]['padded_img'] == ''
+    assert not backfill.queue
+    assert backfill.fill(items) == 0